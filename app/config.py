@@ -1,5 +1,9 @@
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# допустимые форматы хранения ALS-факторов (см. services/quantize.py)
+FactorsDtype = Literal["float32", "float16", "int8"]
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -11,6 +15,22 @@ class Settings(BaseSettings):
 
     artifacts_dir: str = "/app/artifacts"
 
+    # сколько ждать `python -m app.train`, запущенного из POST /train
+    train_timeout_seconds: float = 3600.0
+
+    # в каком виде хранить и сервить ALS-факторы: float32 | float16 | int8
+    factors_dtype: FactorsDtype = "float32"
+
+    # число итераций ALS при инкрементальном дообучении (факторы стартуют с прошлого артефакта)
+    incremental_iterations: int = 5
+
+    # микро-батчинг персональных запросов: окно сбора и максимальный размер пачки
+    batching_enabled: bool = False
+    batch_window_ms: float = 2.0
+    batch_max_size: int = 32
+    # запас на скоринг пачки: не дождавшись результата за 4 окна + этот бюджет, запрос скорится сам
+    batch_scoring_budget_ms: float = 200.0
+
     @property
     def db_url(self) -> str:
         return f"postgresql+psycopg2://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
@@ -1,11 +1,27 @@
-from fastapi import FastAPI, Depends, Query
+import json
+import os
+import subprocess
+import sys
+import threading
+from contextlib import asynccontextmanager
+from typing import Literal
+from fastapi import FastAPI, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
+from .config import FactorsDtype, settings
 from .db import SessionLocal, db_ping
 from .schemas import RecommendationResponse
-from .services.recommend import recommend_restaurants, recommend_dishes
-from .services.train import train_stub
+from .services.recommend import recommend_restaurants, recommend_dishes, warmup, is_ready, loaded_models, batching_stats
 
-app = FastAPI(title="Food Recommender Service", version="0.1.0")
+# корень проекта, чтобы `python -m app.train` нашёл пакет app
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # прогрев в фоне: /health отвечает сразу, /ready — только после загрузки моделей
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    yield
+
+app = FastAPI(title="Food Recommender Service", version="0.1.0", lifespan=lifespan)
 
 def get_db():
     db = SessionLocal()
@@ -18,9 +34,60 @@ def get_db():
 def health():
     return {"status": "ok", "db": "up" if db_ping() else "down"}
 
+@app.get("/ready")
+def ready():
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="warming up")
+    return {"status": "ready", "models": loaded_models()}
+
+@app.get("/metrics/batching")
+def metrics_batching():
+    return batching_stats()
+
 @app.post("/train")
-def train(db: Session = Depends(get_db)):
-    return train_stub(db)
+def train(
+    factors_dtype: FactorsDtype | None = Query(default=None),
+    mode: Literal["full", "incremental"] = Query(default="full"),
+    compare_full: bool = Query(default=False),
+):
+    # обучение в отдельном процессе: стек implicit/scipy не попадает в память API-воркера
+    cmd = [sys.executable, "-m", "app.train", "--mode", mode]
+    if factors_dtype:
+        cmd += ["--factors-dtype", factors_dtype]
+    if compare_full:
+        cmd.append("--compare-full")
+    try:
+        proc = subprocess.run(
+            cmd, cwd=PROJECT_ROOT, capture_output=True, text=True, timeout=settings.train_timeout_seconds
+        )
+    except subprocess.TimeoutExpired as e:
+        raise HTTPException(
+            status_code=504,
+            detail=f"training timed out after {settings.train_timeout_seconds}s: {_tail(e.stdout)} {_tail(e.stderr)}",
+        )
+    if proc.returncode != 0:
+        raise HTTPException(status_code=500, detail=_tail(proc.stderr))
+
+    # результат — последняя непустая строка stdout
+    lines = proc.stdout.strip().splitlines()
+    try:
+        result = json.loads(lines[-1])
+    except (IndexError, json.JSONDecodeError):
+        raise HTTPException(
+            status_code=500,
+            detail=f"training produced no JSON result: stdout={_tail(proc.stdout)} stderr={_tail(proc.stderr)}",
+        )
+
+    # перечитываем свежие артефакты до того, как на них придёт трафик
+    warmup()
+    return result
+
+def _tail(out, n=2000):
+    if out is None:
+        return ""
+    if isinstance(out, bytes):
+        out = out.decode("utf-8", errors="replace")
+    return out[-n:]
 
 @app.get("/recommend/restaurants", response_model=RecommendationResponse)
 def recommend_restaurants_api(
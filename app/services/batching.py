@@ -0,0 +1,169 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import numpy as np
+from ..config import settings
+from .quantize import dequantize_factors
+
+
+class _Request:
+    __slots__ = ("model", "u_idx", "k", "enqueued_at", "future")
+
+    def __init__(self, model, u_idx, k):
+        self.model = model
+        self.u_idx = u_idx
+        self.k = k
+        self.enqueued_at = time.perf_counter()
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Собирает персональные запросы за короткое окно (или до max_batch штук) и скорит их одним GEMM
+    с батчевым top-k. Эндпоинты синхронные и крутятся в тредпуле, поэтому каждый запрос
+    просто ждёт свой Future, а скоринг делает один фоновый поток.
+    """
+
+    def __init__(self, window_ms: float, max_batch: int, scoring_budget_ms: float = 200.0):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        # сколько запрос ждёт результат, прежде чем уйти на инлайн-скоринг (FutureTimeoutError из topk)
+        self.timeout = 4 * self.window + scoring_budget_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._max_batch_seen = 0
+        self._delay_total = 0.0
+        self._delay_max = 0.0
+        self._timeouts = 0
+
+    def topk(self, model, u_idx: int, k: int):
+        """
+        Возвращает (top_idx, top_scores) для пользователя u_idx, отсортированные по убыванию скора.
+        Если результат не пришёл за self.timeout, бросает FutureTimeoutError — вызывающий скорит сам.
+        """
+        self._ensure_started()
+        req = _Request(model, u_idx, k)
+        self._queue.put(req)
+        try:
+            return req.future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # отменяем, чтобы скорер не тратил на запрос время, если ещё не взял его в работу
+            req.future.cancel()
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_batch": self.max_batch,
+                "batches": self._batches,
+                "requests": self._requests,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "max_batch_size": self._max_batch_seen,
+                "mean_queue_delay_ms": 1000.0 * self._delay_total / self._requests if self._requests else 0.0,
+                "max_queue_delay_ms": 1000.0 * self._delay_max,
+                "timeouts": self._timeouts,
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # отменённые по таймауту запросы выкидываем; после этого cancel() их уже не тронет
+            batch = [req for req in batch if req.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._record(batch, time.perf_counter())
+
+                # в одном окне могут оказаться разные модели (рестораны/блюда или перечитанный артефакт)
+                groups = {}
+                for req in batch:
+                    groups.setdefault(id(req.model), []).append(req)
+                for reqs in groups.values():
+                    self._score(reqs)
+            except Exception as e:
+                for req in batch:
+                    if not req.future.done():
+                        req.future.set_exception(e)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        # сначала забираем всё, что накопилось, пока считали прошлую пачку: под нагрузкой
+        # окно к этому моменту уже истекло, и без этого пачки вырождаются в одиночные запросы
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # окном ограничено только ожидание новых запросов; отсчёт — с момента, как взяли голову очереди
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _record(self, batch, started):
+        delays = [started - req.enqueued_at for req in batch]
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            self._delay_total += sum(delays)
+            self._delay_max = max(self._delay_max, max(delays))
+
+    @staticmethod
+    def _score(reqs):
+        model = reqs[0].model
+        rows = np.fromiter((req.u_idx for req in reqs), dtype=np.int64, count=len(reqs))
+        users = dequantize_factors(model["user_factors"], model.get("user_scales"), rows=rows)  # (b, f)
+        scores = users @ model["item_factors"].T                                                  # (b, n_items)
+
+        k_eff = min(max(req.k for req in reqs), scores.shape[1])
+        top = np.argpartition(-scores, k_eff - 1, axis=1)[:, :k_eff]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        for i, req in enumerate(reqs):
+            req.future.set_result((top[i, :req.k], top_scores[i, :req.k]))
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def get_batcher():
+    """
+    Общий батчер процесса или None, если микро-батчинг выключен в настройках.
+    """
+    global _batcher
+    if not settings.batching_enabled:
+        return None
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(
+                    settings.batch_window_ms, settings.batch_max_size, settings.batch_scoring_budget_ms
+                )
+    return _batcher
@@ -0,0 +1,37 @@
+from typing import get_args
+import numpy as np
+from ..config import FactorsDtype
+
+
+FACTOR_DTYPES = get_args(FactorsDtype)
+
+def quantize_factors(factors, dtype: str):
+    """
+    Квантует матрицу факторов (n, f) для хранения/сервинга.
+    Возвращает (q, scales): scales — построчные масштабы (n,) для int8, иначе None.
+    """
+    factors = np.asarray(factors, dtype=np.float32)
+    if dtype == "float32":
+        return factors, None
+    if dtype == "float16":
+        return factors.astype(np.float16), None
+    if dtype == "int8":
+        # симметричная квантизация по строке: max|x| -> 127
+        scales = np.abs(factors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        q = np.rint(factors / scales[:, None]).astype(np.int8)
+        return q, scales.astype(np.float32)
+    raise ValueError(f"Unknown factors dtype: {dtype}, expected one of {FACTOR_DTYPES}")
+
+def dequantize_factors(q, scales=None, rows=None):
+    """
+    Обратное преобразование во float32. rows — индекс строки или массив индексов,
+    чтобы не разворачивать всю матрицу ради одного пользователя.
+    """
+    if rows is not None:
+        q = q[rows]
+        scales = scales[rows] if scales is not None else None
+    out = np.asarray(q, dtype=np.float32)
+    if scales is not None:
+        out = out * np.asarray(scales, dtype=np.float32)[..., None]
+    return out
@@ -1,17 +1,68 @@
 import os
+import threading
 import numpy as np
 import joblib
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from ..config import settings
 from ..schemas import RecommendationItem
+from .quantize import dequantize_factors
+from .batching import FutureTimeoutError, get_batcher
 
 
+MODEL_NAMES = ("restaurants", "dishes")
+
+# name -> (mtime артефакта, blob); перечитываем файл только если он изменился
+_models = {}
+_models_lock = threading.Lock()
+_ready = threading.Event()
+
 def _load_model(name: str):
     path = os.path.join(settings.artifacts_dir, f"als_{name}.joblib")
-    if not os.path.exists(path):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
         return None
-    return joblib.load(path)
+
+    cached = _models.get(name)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with _models_lock:
+        cached = _models.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        blob = _read_model(path)
+        _models[name] = (mtime, blob)
+        return blob
+
+def _read_model(path: str):
+    blob = joblib.load(path)
+    # item-факторы маленькие и участвуют в каждом скоринге целиком -> сразу во float32 (BLAS GEMV);
+    # user-факторы остаются квантованными, нужная строка разворачивается на лету
+    blob["item_factors"] = dequantize_factors(blob["item_factors"], blob.get("item_scales"))
+    blob["item_scales"] = None
+    return blob
+
+def warmup():
+    """
+    Загружает артефакты в память и прогоняет один скоринг, чтобы первый запрос не платил за это.
+    Возвращает {name: loaded}. После первого вызова сервис считается готовым (is_ready).
+    """
+    status = {}
+    for name in MODEL_NAMES:
+        model = _load_model(name)
+        status[name] = model is not None
+        if model is not None and model["idx_to_user"]:
+            _als_recommend(model, model["idx_to_user"][0], 1)
+    _ready.set()
+    return status
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def loaded_models():
+    return {name: name in _models for name in MODEL_NAMES}
 
 def _popular_restaurants(db: Session, k: int):
     q = text("""
@@ -45,15 +96,43 @@ def _als_recommend(model_blob, user_id: str, k: int):
         return None
 
     u_idx = u2i[user_id]
-    U = model_blob["user_factors"]     # (n_users, f)
-    V = model_blob["item_factors"]     # (n_items, f)
-    scores = V @ U[u_idx]              # (n_items,)
+    U = model_blob["user_factors"]     # (n_users, f), может быть float16/int8
+    V = model_blob["item_factors"]     # (n_items, f), float32
+    u = dequantize_factors(U, model_blob.get("user_scales"), rows=u_idx)
+    scores = V @ u                     # (n_items,)
 
     # исключим то, что пользователь уже заказывал (просто по train-истории из БД, быстро)
     # Для простоты: не исключаем — тоже допустимо, но лучше исключить.
     # Здесь сделаем исключение через запрос на seen items по типу модели.
     return scores
 
+def _als_topk(model_blob, user_id: str, k: int):
+    """
+    (top_idx, top_scores) по убыванию скора или None, если пользователя нет в модели.
+    С включённым микро-батчингом скоринг идёт пачкой вместе с параллельными запросами.
+    """
+    batcher = get_batcher()
+    if batcher is not None:
+        u_idx = model_blob["user_to_idx"].get(user_id)
+        if u_idx is None:
+            return None
+        try:
+            return batcher.topk(model_blob, u_idx, k)
+        except FutureTimeoutError:
+            # скорер не ответил вовремя (завис/упал) — считаем этот запрос сами
+            pass
+
+    scores = _als_recommend(model_blob, user_id, k)
+    if scores is None:
+        return None
+    top = np.argpartition(-scores, min(k, len(scores)-1))[:k]
+    top = top[np.argsort(-scores[top])]
+    return top, scores[top]
+
+def batching_stats():
+    batcher = get_batcher()
+    return {"enabled": batcher is not None, **(batcher.stats() if batcher is not None else {})}
+
 def recommend_restaurants(db: Session, user_id: str | None, k: int):
     if not user_id or not _user_has_history(db, user_id):
         return "popular", _popular_restaurants(db, k)
@@ -62,9 +141,10 @@ def recommend_restaurants(db: Session, user_id: str | None, k: int):
     if model is None:
         return "popular", _popular_restaurants(db, k)
 
-    scores = _als_recommend(model, user_id, k)
-    if scores is None:
+    res = _als_topk(model, user_id, k)
+    if res is None:
         return "popular", _popular_restaurants(db, k)
+    top, top_scores = res
 
     # исключаем рестораны, которые пользователь уже заказывал
     # seen_rows = db.execute(text("""
@@ -76,14 +156,11 @@ def recommend_restaurants(db: Session, user_id: str | None, k: int):
     # if seen:
     #     scores[list(seen)] = -np.inf
 
-    top = np.argpartition(-scores, min(k, len(scores)-1))[:k]
-    top = top[np.argsort(-scores[top])]
-
     items = []
-    for idx in top:
+    for idx, score in zip(top, top_scores):
         item_id = model["idx_to_item"][int(idx)]
         title = model["titles"].get(item_id, str(item_id))
-        items.append(RecommendationItem(id=str(item_id), title=str(title), score=float(scores[idx])))
+        items.append(RecommendationItem(id=str(item_id), title=str(title), score=float(score)))
 
     return "personalized", items
 
@@ -95,9 +172,10 @@ def recommend_dishes(db: Session, user_id: str | None, k: int):
     if model is None:
         return "popular", _popular_dishes(db, k)
 
-    scores = _als_recommend(model, user_id, k)
-    if scores is None:
+    res = _als_topk(model, user_id, k)
+    if res is None:
         return "popular", _popular_dishes(db, k)
+    top, top_scores = res
 
     # исключаем блюда, которые пользователь уже заказывал
     # seen_rows = db.execute(text("""
@@ -110,13 +188,10 @@ def recommend_dishes(db: Session, user_id: str | None, k: int):
     # if seen:
     #     scores[list(seen)] = -np.inf
 
-    top = np.argpartition(-scores, min(k, len(scores)-1))[:k]
-    top = top[np.argsort(-scores[top])]
-
     items = []
-    for idx in top:
+    for idx, score in zip(top, top_scores):
         item_id = model["idx_to_item"][int(idx)]
         title = model["titles"].get(item_id, str(item_id))
-        items.append(RecommendationItem(id=str(item_id), title=str(title), score=float(scores[idx])))
+        items.append(RecommendationItem(id=str(item_id), title=str(title), score=float(score)))
 
     return "personalized", items
@@ -1,10 +1,13 @@
 import os
+import time
+import uuid
 import numpy as np
 import joblib
 from scipy.sparse import coo_matrix, csr_matrix
 from sqlalchemy import text
 from implicit.als import AlternatingLeastSquares
 from ..config import settings
+from .quantize import FACTOR_DTYPES, quantize_factors, dequantize_factors
 
 
 K_EVAL = 5
@@ -58,53 +61,171 @@ def _topk_scores(user_factors, item_factors, user_idx, seen_item_idx_set, k):
     top = top[np.argsort(-scores[top])]
     return top
 
-def _fit_als(interactions_csr: csr_matrix, factors=64, reg=0.01, iterations=20, seed=42):
+def _fit_als(interactions_csr: csr_matrix, factors=64, reg=0.01, iterations=20, seed=42,
+             user_factors=None, item_factors=None):
     model = AlternatingLeastSquares(
         factors=factors,
         regularization=reg,
         iterations=iterations,
         random_state=seed
     )
+    # warm start: implicit не инициализирует случайно уже заданные факторы.
+    # fit идёт на item-user матрице, поэтому наши users -> model.item_factors, items -> model.user_factors
+    if user_factors is not None and item_factors is not None:
+        model.item_factors = np.ascontiguousarray(user_factors, dtype=np.float32)
+        model.user_factors = np.ascontiguousarray(item_factors, dtype=np.float32)
     # implicit ожидает item-user матрицу для fit
     model.fit(interactions_csr.T)
     return model
 
+def _extend_factors(factors, n_rows, seed=42):
+    """
+    Дописывает строки для новых пользователей/айтемов: малые случайные значения, как при инициализации в implicit.
+    """
+    extra = n_rows - factors.shape[0]
+    if extra <= 0:
+        return factors
+    rng = np.random.default_rng(seed)
+    new_rows = (rng.random((extra, factors.shape[1])) * 0.01).astype(np.float32)
+    return np.vstack([factors, new_rows])
+
 def _ensure_artifacts_dir():
     os.makedirs(settings.artifacts_dir, exist_ok=True)
 
-def train_stub(db):
+def _artifact_path(name):
+    return os.path.join(settings.artifacts_dir, f"als_{name}.joblib")
+
+def _state_path(name):
+    # состояние для инкрементального дообучения (CSR взаимодействий, holdout);
+    # лежит отдельно, чтобы API-воркеры не держали его в памяти
+    return os.path.join(settings.artifacts_dir, f"als_{name}_state.joblib")
+
+def _dump_atomic(obj, path):
+    # пишем во временный файл и подменяем: API перечитывает артефакт по mtime и не должен увидеть его недописанным
+    tmp_path = f"{path}.tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def _load_previous(name):
+    """
+    Предыдущий артефакт + состояние обучения или None, если с них нельзя стартовать.
+    """
+    art_path, state_path = _artifact_path(name), _state_path(name)
+    if not (os.path.exists(art_path) and os.path.exists(state_path)):
+        return None
+    blob = joblib.load(art_path)
+    if blob.get("watermark") is None:
+        return None
+    state = joblib.load(state_path)
+    # артефакт и состояние должны быть из одного запуска: индексы CSR привязаны к idx_to_user/idx_to_item
+    if blob.get("run_id") is None or state.get("run_id") != blob["run_id"] or "null_order_ids" not in state:
+        return None
+    blob.update(state)
+    return blob
+
+def train_stub(db, factors_dtype: str | None = None, mode: str = "full", compare_full: bool = False):
     """
     Обучает ALS для ресторанов и блюд.
+    factors_dtype: float32 | float16 | int8 — в каком виде сохранять факторы (по умолчанию из settings).
+    mode: full — с нуля по всей истории; incremental — только заказы после watermark прошлого
+          артефакта, факторы стартуют с сохранённых (fallback на full, если артефактов нет).
+    compare_full: в incremental дополнительно обучить с нуля на тех же данных и сравнить время/качество.
     Возвращает метрики и пути к артефактам.
     """
+    factors_dtype = factors_dtype or settings.factors_dtype
+    if factors_dtype not in FACTOR_DTYPES:
+        raise ValueError(f"Unknown factors dtype: {factors_dtype}, expected one of {FACTOR_DTYPES}")
+    if mode not in ("full", "incremental"):
+        raise ValueError(f"Unknown training mode: {mode}, expected full or incremental")
     _ensure_artifacts_dir()
 
-    # 1) Сплит: для каждого customer_id последний order_id по времени -> test_orders
-    test_orders = db.execute(text("""
-        WITH ranked AS (
-          SELECT
-            order_id,
-            customer_id,
-            order_placed_at,
-            ROW_NUMBER() OVER (PARTITION BY customer_id ORDER BY order_placed_at DESC) AS rn
-          FROM orders
-          WHERE order_placed_at IS NOT NULL
-        )
-        SELECT order_id, customer_id
-        FROM ranked
-        WHERE rn = 1
-    """)).fetchall()
-
-    test_order_ids = set(int(r.order_id) for r in test_orders)
+    # всё, что размещено не позже watermark, попадёт в этот запуск; следующий incremental читает только после него
+    watermark = db.execute(text("SELECT MAX(order_placed_at) FROM orders")).scalar()
+
+    prev = {}
+    note = "Split: last order per user in test; ALS trained on remaining orders."
+    if mode == "incremental":
+        prev = {name: _load_previous(name) for name in ("restaurants", "dishes")}
+        # рестораны и блюда обучаются вместе: стартуем только с пары артефактов из одного запуска
+        prev_runs = {p["run_id"] for p in prev.values() if p is not None}
+        if None in prev.values() or len(prev_runs) != 1:
+            mode, prev = "full", {}
+            note = "No consistent previous artifacts and state, fell back to full rebuild. " + note
+
+    if mode == "full":
+        # 1) Сплит: для каждого customer_id последний order_id по времени -> test_orders
+        test_orders = db.execute(text("""
+            WITH ranked AS (
+              SELECT
+                order_id,
+                customer_id,
+                order_placed_at,
+                ROW_NUMBER() OVER (PARTITION BY customer_id ORDER BY order_placed_at DESC) AS rn
+              FROM orders
+              WHERE order_placed_at IS NOT NULL AND order_placed_at <= :wm
+            )
+            SELECT order_id, customer_id
+            FROM ranked
+            WHERE rn = 1
+        """), {"wm": watermark}).fetchall()
+
+        test_order_ids = set(int(r.order_id) for r in test_orders)
+        # заказы без order_placed_at watermark не покрывает: фиксируем их id, чтобы incremental добрал только новые
+        null_order_ids = {int(r.order_id) for r in db.execute(text(
+            "SELECT order_id FROM orders WHERE order_placed_at IS NULL"
+        )).fetchall()}
+        # train: все заказы кроме test_order_ids и тех, что после watermark (их прочитает следующий incremental)
+        train_cond = "{p}order_id <> ALL(:test_ids) AND ({p}order_placed_at <= :wm OR {p}order_id = ANY(:null_ids))"
+        params = {"test_ids": list(test_order_ids), "wm": watermark, "null_ids": list(null_order_ids)}
+        new_orders = None
+    else:
+        # 1) Дельта: новые заказы после watermark + holdout прошлого запуска (его не было в CSR)
+        # + заказы без order_placed_at, которых ещё нет в CSR (в full они идут в train, значит и здесь тоже).
+        # Сплит только по новым заказам: последний новый заказ пользователя -> test, остальное -> train
+        prev_state = prev["restaurants"]
+        delta = db.execute(text("""
+            SELECT order_id, customer_id, order_placed_at, COALESCE(order_placed_at > :prev_wm, FALSE) AS is_new
+            FROM orders
+            WHERE (order_placed_at > :prev_wm AND order_placed_at <= :wm)
+               OR order_id = ANY(:holdout)
+               OR (order_placed_at IS NULL AND order_id <> ALL(:merged_null))
+        """), {
+            "prev_wm": prev_state["watermark"],
+            "wm": watermark,
+            "holdout": list(prev_state["holdout_order_ids"]),
+            "merged_null": list(prev_state["null_order_ids"]),
+        }).fetchall()
+        null_order_ids = set(prev_state["null_order_ids"]) | {
+            int(r.order_id) for r in delta if r.order_placed_at is None
+        }
+
+        last_new = {}
+        for r in delta:
+            if r.is_new and (r.customer_id not in last_new or r.order_placed_at > last_new[r.customer_id][0]):
+                last_new[r.customer_id] = (r.order_placed_at, int(r.order_id))
+        test_order_ids = {oid for _, oid in last_new.values()}
+        train_order_ids = {int(r.order_id) for r in delta} - test_order_ids
+
+        train_cond = "{p}order_id = ANY(:train_ids)"
+        params = {"test_ids": list(test_order_ids), "train_ids": list(train_order_ids)}
+        new_orders = sum(1 for r in delta if r.is_new)
+        note = "Incremental: orders after previous watermark merged into stored interactions, ALS warm-started; last new order per user in test."
+
+    run = {
+        "run_id": uuid.uuid4().hex,
+        "watermark": watermark,
+        "holdout_order_ids": sorted(test_order_ids),
+        "null_order_ids": sorted(null_order_ids),
+        "compare_full": compare_full,
+    }
 
     # -------------------- Restaurants interactions --------------------
-    # train: все заказы кроме test_order_ids
-    rest_rows = db.execute(text("""
+    rest_rows = db.execute(text(f"""
         SELECT customer_id::text AS customer_id, restaurant_id::int AS restaurant_id, COUNT(*)::float AS w
         FROM orders
-        WHERE order_id <> ALL(:test_ids)
+        WHERE {train_cond.format(p="")}
         GROUP BY 1,2
-    """), {"test_ids": list(test_order_ids)}).fetchall()
+    """), params).fetchall()
 
     # test ground truth: ресторан из последнего заказа
     rest_test_rows = db.execute(text("""
@@ -122,18 +243,20 @@ def train_stub(db):
             SELECT restaurant_id::int AS item_id, restaurant_name::text AS title
             FROM restaurants
         """,
-        db=db
+        db=db,
+        factors_dtype=factors_dtype,
+        prev=prev.get("restaurants"),
+        run=run,
     )
 
     # -------------------- Dishes interactions --------------------
-    # train: все order_items, где order_id не в test
-    dish_rows = db.execute(text("""
+    dish_rows = db.execute(text(f"""
         SELECT o.customer_id::text AS customer_id, oi.dish_id::text AS dish_id, SUM(oi.qty)::float AS w
         FROM order_items oi
         JOIN orders o ON o.order_id = oi.order_id
-        WHERE oi.order_id <> ALL(:test_ids)
+        WHERE {train_cond.format(p="o.")}
         GROUP BY 1,2
-    """), {"test_ids": list(test_order_ids)}).fetchall()
+    """), params).fetchall()
 
     # test ground truth: блюда из последнего заказа пользователя
     dish_test_rows = db.execute(text("""
@@ -153,20 +276,63 @@ def train_stub(db):
             FROM order_items
             GROUP BY 1,2
         """,
-        db=db
+        db=db,
+        factors_dtype=factors_dtype,
+        prev=prev.get("dishes"),
+        run=run,
     )
 
     return {
         "status": "ok",
+        "mode": mode,
+        "watermark": watermark.isoformat() if watermark is not None else None,
+        "new_orders": new_orders,
+        "factors_dtype": factors_dtype,
         "restaurants": {"metrics@5": rest_metrics, "artifacts": rest_art},
         "dishes": {"metrics@5": dish_metrics, "artifacts": dish_art},
-        "note": "Split: last order per user in test; ALS trained on remaining orders."
+        "note": note
     }
 
-def _train_one(name, train_rows, test_rows, item_id_field, item_title_query, db):
+def _evaluate(user_factors, item_factors, gt, user_to_idx, item_to_idx):
+    """
+    Recall/NDCG@K_EVAL по пользователям из gt, которые есть в train.
+    """
+    recalls = []
+    ndcgs = []
+
+    for uid, rel_items in gt.items():
+        if uid not in user_to_idx:
+            continue
+        u_idx = user_to_idx[uid]
+
+        # релевантные item_idx (только те, что есть в train items)
+        rel_idx = {item_to_idx[x] for x in rel_items if x in item_to_idx}
+        if not rel_idx:
+            continue
+
+        top_idx = _topk_scores(user_factors, item_factors, u_idx, set(), K_EVAL)
+        recalls.append(_recall_at_k(top_idx, rel_idx, K_EVAL))
+        ndcgs.append(_ndcg_at_k(top_idx, rel_idx, K_EVAL))
+
+    return {
+        "recall": float(np.mean(recalls)) if recalls else 0.0,
+        "ndcg": float(np.mean(ndcgs)) if ndcgs else 0.0,
+    }
+
+def _train_one(name, train_rows, test_rows, item_id_field, item_title_query, db, factors_dtype="float32",
+               prev=None, run=None):
     # train_rows: (customer_id, item_id, w)
-    users = sorted({r.customer_id for r in train_rows})
-    items = sorted({getattr(r, item_id_field) for r in train_rows})
+    run = run or {}
+    if prev is None:
+        users = sorted({r.customer_id for r in train_rows})
+        items = sorted({getattr(r, item_id_field) for r in train_rows})
+    else:
+        # incremental: старые индексы не меняются, новые пользователи/айтемы дописываются в конец
+        users = list(prev["idx_to_user"])
+        items = list(prev["idx_to_item"])
+        known_users, known_items = set(users), set(items)
+        users += sorted({r.customer_id for r in train_rows} - known_users)
+        items += sorted({getattr(r, item_id_field) for r in train_rows} - known_items)
 
     if len(users) == 0 or len(items) == 0:
         raise RuntimeError(f"Not enough data to train ALS for {name}")
@@ -188,7 +354,26 @@ def _train_one(name, train_rows, test_rows, item_id_field, item_title_query, db)
 
     mat = coo_matrix((data, (row_idx, col_idx)), shape=(len(users), len(items))).tocsr()
 
-    model = _fit_als(mat, factors=64, reg=0.01, iterations=20)
+    t0 = time.perf_counter()
+    if prev is None:
+        model = _fit_als(mat, factors=64, reg=0.01, iterations=20)
+    else:
+        # веса — счётчики/количества, поэтому слияние с сохранённой матрицей — просто сумма
+        old = prev["interactions"].tocsr()
+        old.resize(mat.shape)
+        mat = (old + mat).tocsr()
+
+        user_init = _extend_factors(
+            dequantize_factors(prev["user_factors"], prev.get("user_scales")), len(users), seed=len(users)
+        )
+        item_init = _extend_factors(
+            dequantize_factors(prev["item_factors"], prev.get("item_scales")), len(items), seed=len(items)
+        )
+        model = _fit_als(
+            mat, factors=user_init.shape[1], reg=0.01, iterations=settings.incremental_iterations,
+            user_factors=user_init, item_factors=item_init,
+        )
+    train_seconds = time.perf_counter() - t0
 
     # titles для красивого ответа (id -> title)
     titles = {}
@@ -210,35 +395,49 @@ def _train_one(name, train_rows, test_rows, item_id_field, item_title_query, db)
         it = getattr(r, item_id_field)
         gt.setdefault(uid, set()).add(it)
 
-    # eval по пользователям, которые есть в train
-    recalls = []
-    ndcgs = []
-
-    for uid, rel_items in gt.items():
-        if uid not in user_to_idx:
-            continue
-        u_idx = user_to_idx[uid]
-
-        # релевантные item_idx (только те, что есть в train items)
-        rel_idx = {item_to_idx[x] for x in rel_items if x in item_to_idx}
-        if not rel_idx:
-            continue
-
-        # top_idx = _topk_scores(model.user_factors, model.item_factors, u_idx, seen[u_idx], K_EVAL)
-        # top_idx = _topk_scores(model.item_factors, model.user_factors, u_idx, seen[u_idx], K_EVAL)
-        top_idx = _topk_scores(model.item_factors, model.user_factors, u_idx, set(), K_EVAL)
-        recalls.append(_recall_at_k(top_idx, rel_idx, K_EVAL))
-        ndcgs.append(_ndcg_at_k(top_idx, rel_idx, K_EVAL))
+    # users -> model.item_factors, items -> model.user_factors (fit делали на item-user матрице)
+    user_factors = np.asarray(model.item_factors, dtype=np.float32)
+    item_factors = np.asarray(model.user_factors, dtype=np.float32)
+
+    # eval по пользователям, которые есть в train: сначала float32, затем то, что реально сохраним
+    metrics_fp32 = _evaluate(user_factors, item_factors, gt, user_to_idx, item_to_idx)
+
+    user_q, user_scales = quantize_factors(user_factors, factors_dtype)
+    item_q, item_scales = quantize_factors(item_factors, factors_dtype)
+    if factors_dtype == "float32":
+        metrics_q = metrics_fp32
+    else:
+        metrics_q = _evaluate(
+            dequantize_factors(user_q, user_scales),
+            dequantize_factors(item_q, item_scales),
+            gt, user_to_idx, item_to_idx,
+        )
 
     metrics = {
         "users_in_train": len(users),
         "items_in_train": len(items),
-        "recall": float(np.mean(recalls)) if recalls else 0.0,
-        "ndcg": float(np.mean(ndcgs)) if ndcgs else 0.0,
+        "recall": metrics_q["recall"],
+        "ndcg": metrics_q["ndcg"],
+        "train_seconds": train_seconds,
     }
 
+    # incremental vs обучение с нуля на тех же данных и том же сплите (только для отчёта, не сохраняется)
+    if prev is not None and run.get("compare_full"):
+        t0 = time.perf_counter()
+        full_model = _fit_als(mat, factors=64, reg=0.01, iterations=20)
+        full_seconds = time.perf_counter() - t0
+        full_metrics = _evaluate(
+            np.asarray(full_model.item_factors, dtype=np.float32),
+            np.asarray(full_model.user_factors, dtype=np.float32),
+            gt, user_to_idx, item_to_idx,
+        )
+        metrics["vs_full_rebuild"] = {
+            "incremental": {"train_seconds": train_seconds, **metrics_fp32},
+            "full_rebuild": {"train_seconds": full_seconds, **full_metrics},
+        }
+
     # save artifacts
-    art_path = os.path.join(settings.artifacts_dir, f"als_{name}.joblib")
+    art_path = _artifact_path(name)
     # joblib.dump(
     #     {
     #         "name": name,
@@ -252,7 +451,7 @@ def _train_one(name, train_rows, test_rows, item_id_field, item_title_query, db)
     #     },
     #     art_path
     # )
-    joblib.dump(
+    _dump_atomic(
         {
             "name": name,
             "user_to_idx": user_to_idx,
@@ -261,11 +460,54 @@ def _train_one(name, train_rows, test_rows, item_id_field, item_title_query, db)
             "idx_to_item": idx_to_item,
             # сохраняем в понятном виде:
             # users -> model.item_factors, items -> model.user_factors
-            "user_factors": model.item_factors.astype(np.float32),
-            "item_factors": model.user_factors.astype(np.float32),
+            "factors_dtype": factors_dtype,
+            "user_factors": user_q,
+            "item_factors": item_q,
+            # построчные масштабы для int8, иначе None
+            "user_scales": user_scales,
+            "item_scales": item_scales,
             "titles": titles,
+            # заказы с order_placed_at <= watermark учтены; следующий incremental читает только после него
+            "watermark": run.get("watermark"),
+            "run_id": run.get("run_id"),
         },
         art_path
     )
+    # то, что нужно только для следующего incremental: матрица train-взаимодействий и test-заказы,
+    # которые в неё не вошли (их подмешаем при следующем запуске)
+    _dump_atomic(
+        {
+            "interactions": mat,
+            "holdout_order_ids": run.get("holdout_order_ids", []),
+            # заказы без order_placed_at, уже учтённые в interactions
+            "null_order_ids": run.get("null_order_ids", []),
+            "watermark": run.get("watermark"),
+            "run_id": run.get("run_id"),
+        },
+        _state_path(name)
+    )
+
+    # сколько стоит артефакт при сервинге: размер файла, время загрузки, память под факторы
+    t0 = time.perf_counter()
+    joblib.load(art_path)
+    load_seconds = time.perf_counter() - t0
+
+    def _nbytes(*arrays):
+        return int(sum(a.nbytes for a in arrays if a is not None))
+
+    quantization = {
+        "factors_dtype": factors_dtype,
+        "metrics_float32": metrics_fp32,
+        "delta_vs_float32": {
+            "recall": metrics_q["recall"] - metrics_fp32["recall"],
+            "ndcg": metrics_q["ndcg"] - metrics_fp32["ndcg"],
+        },
+        "factors_bytes_float32": _nbytes(user_factors, item_factors),
+        "factors_bytes": _nbytes(user_q, user_scales, item_q, item_scales),
+        # при сервинге item-факторы разворачиваются во float32, пользовательские остаются квантованными
+        "serving_factors_bytes": _nbytes(user_q, user_scales, item_factors),
+        "artifact_bytes": os.path.getsize(art_path),
+        "load_seconds": load_seconds,
+    }
 
-    return metrics, {"model_path": art_path}
+    return metrics, {"model_path": art_path, "state_path": _state_path(name), "quantization": quantization}
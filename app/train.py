@@ -0,0 +1,32 @@
+"""
+Отдельная точка входа для обучения, чтобы API-воркеры не импортировали implicit/scipy:
+    python -m app.train [--factors-dtype int8] [--mode incremental [--compare-full]]
+Результат обучения печатается в stdout одной JSON-строкой.
+"""
+import argparse
+import json
+import sys
+from .db import SessionLocal
+from .services.quantize import FACTOR_DTYPES
+from .services.train import train_stub
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.train", description="Train ALS models for restaurants and dishes")
+    parser.add_argument("--factors-dtype", choices=FACTOR_DTYPES, default=None)
+    parser.add_argument("--mode", choices=("full", "incremental"), default="full")
+    parser.add_argument("--compare-full", action="store_true",
+                        help="in incremental mode also train from scratch on the same data and report both")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        result = train_stub(db, factors_dtype=args.factors_dtype, mode=args.mode, compare_full=args.compare_full)
+    finally:
+        db.close()
+
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import threading
+import time
+import numpy as np
+from app.config import settings
+from app.services import batching, recommend
+from app.services.batching import MicroBatcher
+
+
+def _model(n_users, n_items, f, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        "user_to_idx": {f"u{i}": i for i in range(n_users)},
+        "user_factors": rng.normal(size=(n_users, f)).astype(np.float32),
+        "item_factors": rng.normal(size=(n_items, f)).astype(np.float32),
+        "user_scales": None,
+    }
+
+def _expected(model, u_idx, k):
+    scores = model["item_factors"] @ model["user_factors"][u_idx]
+    top = np.argsort(-scores)[:k]
+    return top, scores[top]
+
+def _run_threads(target, args_list):
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_micro_batcher_matches_single_request_scoring():
+    model = _model(20, 30, 8)
+    batcher = MicroBatcher(window_ms=20, max_batch=8)
+
+    results = {}
+    def worker(u_idx):
+        results[u_idx] = batcher.topk(model, u_idx, 5)
+
+    _run_threads(worker, [(u,) for u in range(16)])
+
+    for u_idx, (top, top_scores) in results.items():
+        expected_top, expected_scores = _expected(model, u_idx, 5)
+        assert list(top) == list(expected_top)
+        assert np.allclose(top_scores, expected_scores, atol=1e-5)
+
+    stats = batcher.stats()
+    assert stats["requests"] == 16
+    assert stats["batches"] < 16
+    assert stats["max_batch_size"] <= 8
+
+def test_micro_batcher_mixes_models_and_k_in_one_window():
+    model_a = _model(10, 40, 8, seed=1)
+    model_b = _model(10, 25, 8, seed=2)
+    batcher = MicroBatcher(window_ms=100, max_batch=64)
+
+    results = {}
+    def worker(name, model, u_idx, k):
+        results[(name, u_idx, k)] = batcher.topk(model, u_idx, k)
+
+    args = [("a", model_a, u, k) for u in range(5) for k in (1, 3, 7)]
+    args += [("b", model_b, u, k) for u in range(5) for k in (2, 30)]  # k > n_items обрезается
+    _run_threads(worker, args)
+
+    for (name, u_idx, k), (top, top_scores) in results.items():
+        model = model_a if name == "a" else model_b
+        expected_top, expected_scores = _expected(model, u_idx, k)
+        assert list(top) == list(expected_top)
+        assert np.allclose(top_scores, expected_scores, atol=1e-4)
+
+    assert batcher.stats()["requests"] == len(args)
+    assert batcher.stats()["batches"] < len(args)
+
+def test_micro_batcher_keeps_batching_under_sustained_load():
+    # скоринг пачки дольше окна: под нагрузкой пачки не должны вырождаться в одиночные запросы
+    model = _model(64, 20000, 64)
+    batcher = MicroBatcher(window_ms=2, max_batch=32)
+
+    stop = time.monotonic() + 1.0
+    def client(u_idx):
+        while time.monotonic() < stop:
+            batcher.topk(model, u_idx, 10)
+
+    _run_threads(client, [(u,) for u in range(32)])
+
+    stats = batcher.stats()
+    assert stats["requests"] > 0
+    assert stats["mean_batch_size"] > 4
+
+def test_als_topk_uses_batcher_when_enabled(monkeypatch):
+    model = _model(5, 30, 8)
+    monkeypatch.setattr(settings, "batching_enabled", True)
+    monkeypatch.setattr(batching, "_batcher", MicroBatcher(window_ms=1, max_batch=8))
+
+    top, top_scores = recommend._als_topk(model, "u3", 4)
+
+    expected_top, _ = _expected(model, 3, 4)
+    assert list(top) == list(expected_top)
+    assert batching.get_batcher().stats()["requests"] == 1
+
+def test_als_topk_falls_back_inline_when_batcher_is_stuck(monkeypatch):
+    model = _model(5, 30, 8)
+    stuck = MicroBatcher(window_ms=1, max_batch=8, scoring_budget_ms=50)
+    monkeypatch.setattr(stuck, "_score", lambda reqs: time.sleep(1.0))
+    monkeypatch.setattr(settings, "batching_enabled", True)
+    monkeypatch.setattr(batching, "_batcher", stuck)
+
+    top, _ = recommend._als_topk(model, "u2", 4)
+
+    expected_top, _ = _expected(model, 2, 4)
+    assert list(top) == list(expected_top)
+    assert stuck.stats()["timeouts"] == 1
@@ -0,0 +1,19 @@
+import numpy as np
+from app.services.quantize import quantize_factors, dequantize_factors
+
+
+def test_quantized_factors_roundtrip_close_to_float32():
+    rng = np.random.default_rng(0)
+    factors = rng.normal(size=(50, 64)).astype(np.float32)
+    factors[3] = 0.0  # нулевая строка не должна давать nan
+
+    for dtype, tol in (("float32", 0.0), ("float16", 1e-2), ("int8", 5e-2)):
+        q, scales = quantize_factors(factors, dtype)
+        assert q.dtype == np.dtype(dtype)
+        restored = dequantize_factors(q, scales)
+        assert restored.dtype == np.float32
+        assert np.all(np.isfinite(restored))
+        assert np.max(np.abs(restored - factors)) <= tol * np.abs(factors).max()
+
+        # одна строка разворачивается так же, как вся матрица
+        assert np.allclose(dequantize_factors(q, scales, rows=7), restored[7])
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from fastapi.testclient import TestClient
+from app.main import app
+from app.config import settings
+from app.services import recommend
+
+REPO_ARTIFACTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "artifacts")
+
+
+def test_ready_after_warmup(monkeypatch):
+    # закоммиченные артефакты: прогрев должен реально их загрузить
+    monkeypatch.setattr(settings, "artifacts_dir", REPO_ARTIFACTS)
+    # чистый процесс: ни кэша моделей, ни флага готовности от предыдущих тестов
+    monkeypatch.setattr(recommend, "_models", {})
+    monkeypatch.setattr(recommend, "_ready", threading.Event())
+    # контекстный менеджер запускает lifespan -> фоновый прогрев моделей
+    with TestClient(app) as client:
+        deadline = time.monotonic() + 30
+        r = client.get("/ready")
+        while r.status_code == 503 and time.monotonic() < deadline:
+            time.sleep(0.1)
+            r = client.get("/ready")
+        assert r.status_code == 200
+        assert r.json()["models"] == {"restaurants": True, "dishes": True}
+
+def test_serving_does_not_import_training_stack():
+    code = "import sys, app.main; assert 'implicit' not in sys.modules and 'scipy' not in sys.modules"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
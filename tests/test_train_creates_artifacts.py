@@ -1,7 +1,10 @@
 import os
+from datetime import timedelta
 from fastapi.testclient import TestClient
+from sqlalchemy import text
 from app.main import app
 from app.config import settings
+from app.db import SessionLocal
 
 def test_train_creates_artifacts():
     client = TestClient(app)
@@ -9,3 +12,48 @@ def test_train_creates_artifacts():
     assert r.status_code == 200
     assert os.path.exists(os.path.join(settings.artifacts_dir, "als_restaurants.joblib"))
     assert os.path.exists(os.path.join(settings.artifacts_dir, "als_dishes.joblib"))
+
+def test_incremental_train_warm_starts_from_previous_artifacts():
+    client = TestClient(app)
+    r = client.post("/train")
+    assert r.status_code == 200
+    full = r.json()
+
+    # после первого обучения: новый пользователь с двумя заказами в новом ресторане с новым блюдом.
+    # первый заказ уходит в train (расширяет id-маппинги), второй — в test
+    db = SessionLocal()
+    try:
+        base = db.execute(text("""
+            SELECT MAX(order_id) AS oid, MAX(restaurant_id) AS rid, MAX(order_placed_at) AS ts FROM orders
+        """)).one()
+        new_orders = [(base.oid + 1, base.ts + timedelta(hours=1)), (base.oid + 2, base.ts + timedelta(hours=2))]
+        for oid, ts in new_orders:
+            db.execute(text("""
+                INSERT INTO orders (order_id, customer_id, restaurant_id, order_placed_at)
+                VALUES (:oid, 'test-incremental-user', :rid, :ts)
+            """), {"oid": oid, "rid": base.rid + 1, "ts": ts})
+            db.execute(text("""
+                INSERT INTO order_items (order_id, restaurant_id, dish_id, dish_name, qty)
+                VALUES (:oid, :rid, 'test-incremental-dish', 'Test dish', 1)
+            """), {"oid": oid, "rid": base.rid + 1})
+        db.commit()
+
+        r = client.post("/train?mode=incremental&compare_full=true")
+        assert r.status_code == 200
+        data = r.json()
+        assert data["mode"] == "incremental"
+        assert data["new_orders"] == 2
+        assert data["watermark"] > full["watermark"]
+        for name in ("restaurants", "dishes"):
+            before, after = full[name]["metrics@5"], data[name]["metrics@5"]
+            # >: кроме тестовых, в матрицу возвращаются holdout-заказы прошлого запуска
+            assert after["users_in_train"] > before["users_in_train"]
+            assert after["items_in_train"] > before["items_in_train"]
+            assert "vs_full_rebuild" in after
+    finally:
+        db.execute(text("DELETE FROM order_items WHERE dish_id = 'test-incremental-dish'"))
+        db.execute(text("DELETE FROM orders WHERE customer_id = 'test-incremental-user'"))
+        db.commit()
+        db.close()
+        # не оставляем тестовые взаимодействия в артефактах и состоянии
+        client.post("/train")